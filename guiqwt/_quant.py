@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the terms of the CECILL License
+# (see guiqwt/__init__.py for details)
+
+"""
+guiqwt._quant
+-------------
+
+The `_quant` module provides Numba-compiled kernels used to quantize large
+float images to unsigned integers (see :py:mod:`guiqwt.qthelpers`).
+
+Importing this module raises ImportError if Numba is not installed: callers
+are expected to fall back to the NumPy implementation.
+"""
+
+import numpy as np
+from numba import njit, prange
+
+# No "nnan" flag: NaN values must be skipped by the min/max comparisons
+_FASTMATH = {"contract", "arcp", "reassoc"}
+
+
+@njit(parallel=True, fastmath=_FASTMATH, cache=True)
+def minmax(data):
+    """Return (min, max) of 2D array `data`, ignoring NaN values"""
+    nrows, ncols = data.shape
+    rmin = np.empty(nrows)
+    rmax = np.empty(nrows)
+    for i in prange(nrows):
+        lo = np.inf
+        hi = -np.inf
+        for j in range(ncols):
+            v = data[i, j]
+            if v < lo:
+                lo = v
+            if v > hi:
+                hi = v
+        rmin[i] = lo
+        rmax[i] = hi
+    return rmin.min(), rmax.max()
+
+
+@njit(parallel=True, fastmath=_FASTMATH, cache=True)
+def float_to_uint(data, out, lo, scale, vmax):
+    """Quantize 2D float array `data` into unsigned integer array `out`:
+    out = rint((data - lo) * scale), clipped to [0, vmax]"""
+    nrows, ncols = data.shape
+    for i in prange(nrows):
+        for j in range(ncols):
+            v = np.rint((data[i, j] - lo) * scale)
+            out[i, j] = min(vmax, max(0.0, v))
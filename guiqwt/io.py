@@ -407,6 +407,26 @@ def _imread_sif(filename):
     return sif.data
 
 
+def _memmap_raw(filename, shape, dtype, offset):
+    """Return a copy-on-write memory map of raw image file `filename`:
+    `shape` is [width, height], `offset` is either a byte offset or one of
+    'from_end' (image data is at the end of the file) and 'from_end_4k'
+    (same as 'from_end' with a 4092-byte trailer).
+
+    Pixel data is only read from disk when accessed; the returned array is
+    writable (modifications are not written back to the file). Note that the
+    file stays open as long as the array is alive (hence locked on Windows)."""
+    if dtype.kind not in "iu" or dtype.itemsize not in (2, 4):
+        raise ValueError("Wrong input value for dtype!")
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    if offset == 'from_end':
+        offset = osp.getsize(filename) - nbytes
+    elif offset == 'from_end_4k':
+        offset = osp.getsize(filename) - nbytes - 4092
+    return np.memmap(filename, dtype=dtype, mode='c', offset=int(offset),
+                     shape=tuple(shape[::-1]))
+
+
 def _imread_raw(filename, params={}):
     """Open raw file image and return a NumPy array"""
     _base, ext = osp.splitext(filename)
@@ -461,28 +481,7 @@ def _imread_raw(filename, params={}):
             
         header.close()
         shape = [Ypixelnum,Xpixelnum]
-        dtype = params['dtype']
-        if dtype.str=='<i4' or dtype.str=='<u4' or dtype.str=='>i4' or dtype.str=='>u4' :
-                nbytes = 4
-        elif dtype.str=='<i2' or dtype.str=='<u2' or dtype.str=='>i2' or dtype.str=='>u2':
-                nbytes = 2
-        else:
-            raise ValueError("Wrong input value for dtype!")
-        if params['offset'] == 'from_end' :    
-            offset = -np.prod(shape)*nbytes
-            whence = 2
-        elif params['offset'] == 'from_end_4k':
-            offset = -np.prod(shape)*nbytes - 4092
-            whence = 2
-        else :
-            offset = params['offset']
-            whence = 0
-        with open(filename,'rb') as f:
-            print(shape,dtype,offset,whence)
-            f.seek(offset,whence)
-            data = np.fromfile(f, dtype=dtype, count=np.prod(shape))
-            data = data.reshape(shape[::-1])
-        return data
+        return _memmap_raw(filename, shape, params['dtype'], params['offset'])
     else:
         from pyhamareader import HamamatsuFile
         try :
@@ -503,28 +502,8 @@ def _imread_raw(filename, params={}):
             if not shapeparam.edit() :
                 return
             shape = [shapeparam.x,shapeparam.y]
-            dtype = params['dtype']
-            if dtype.str=='<i4' or dtype.str=='<u4' or dtype.str=='>i4' or dtype.str=='>u4' :
-                    nbytes = 4
-            elif dtype.str=='<i2' or dtype.str=='<u2' or dtype.str=='>i2' or dtype.str=='>u2':
-                    nbytes = 2
-            else:
-                raise ValueError("Wrong input value for dtype!")
-            if params['offset'] == 'from_end' :    
-                offset = -np.prod(shape)*nbytes
-                whence = 2
-            elif params['offset'] == 'from_end_4k':
-                offset = -np.prod(shape)*nbytes - 4092
-                whence = 2
-            else :
-                offset = params['offset']
-                whence = 0
-            with open(filename,'rb') as f:
-                print(shape,dtype,offset,whence)
-                f.seek(offset,whence)
-                data = np.fromfile(f, dtype=dtype, count=np.prod(shape))
-                data = data.reshape(shape[::-1])
-            return data
+            return _memmap_raw(filename, shape, params['dtype'],
+                               params['offset'])
         
 def _imread_hdf5(filename,params={}):
     import h5py 
@@ -630,7 +609,6 @@ def imread(fname, ext=None, to_grayscale=False, params={}):
     guessed from filename."""
     if ext is None:
         _base, ext = osp.splitext(fname)
-    arr = iohandler.get_readfunc(ext)(fname)
     if ext in iohandler._get_extensions('RAW files'):
         arr = iohandler.get_readfunc(ext)(fname, params=params)
     else :
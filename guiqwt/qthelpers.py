@@ -28,17 +28,325 @@ Reference
 .. autofunction:: exec_images_open_dialog
 """
 
-import sys
 import os.path as osp
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from functools import lru_cache
+from importlib import import_module
+from io import StringIO
+
 import numpy as np
 
-from qtpy.QtWidgets import QMessageBox
+from qtpy.QtWidgets import QMessageBox, QFileDialog
 from qtpy.compat import getsavefilename, getopenfilename, getopenfilenames
 
 # Local imports
 from guiqwt.config import _
 from guiqwt import io
 
+try:
+    from guiqwt._cvt import f32_to_uint
+except ImportError:
+    f32_to_uint = None
+
+
+#: Extensions of the text-like formats which are always written as is
+_TEXT_EXTS = frozenset({".txt", ".csv", ".asc", ".dat", ".npy"})
+#: Integer data type used to save float data, by file extension
+#: (formats which are not listed here are saved as 8-bit integers)
+_EXT_SAVE_DTYPE = {
+    ".tif": np.dtype(np.uint16),
+    ".tiff": np.dtype(np.uint16),
+    ".dcm": np.dtype(np.uint16),
+}
+#: Extensions of the raw image formats (opened with user-defined parameters
+#: unless a ".inf" header file is found)
+_RAW_EXTS = frozenset({".bin", ".raw", ".img", ".imd"})
+#: Minimum image size (in pixels) for using the Numba kernels (if available):
+#: below this size, the JIT warm-up cost outweighs the parallel speed-up
+_JIT_MIN_SIZE = 1 << 20
+#: Minimum float image size (in bytes) above which TIFF files are written band
+#: by band (with tifffile) instead of quantizing the whole image in memory
+_STREAM_THRESHOLD = 512 * 1024 ** 2
+#: Tile size (in pixels) used when streaming images to TIFF files
+_TILE_SIZE = 512
+#: Maximum size (in bytes) of the scratch buffers kept between conversions
+_SCRATCH_MAX_NBYTES = 256 * 1024 ** 2
+#: File dialog options: skip per-entry custom icon lookups and symlink
+#: resolution, which make dialogs very slow on network file systems or in
+#: directories containing thousands of files
+_DIALOG_OPTIONS = (
+    QFileDialog.DontUseCustomDirectoryIcons | QFileDialog.DontResolveSymlinks
+)
+
+
+_optional_modules = {}
+
+
+def _import_optional(modname):
+    """Return optional dependency module `modname` (None if not installed),
+    imported on first call: importing this module does not pay the (large)
+    import cost of dependencies which may never be used"""
+    if modname not in _optional_modules:
+        try:
+            _optional_modules[modname] = import_module(modname)
+        except ImportError:
+            _optional_modules[modname] = None
+    return _optional_modules[modname]
+
+
+_SCRATCH = {}
+
+
+def _scratch_buffer(dtype, shape):
+    """Return an uninitialized array of `dtype` and `shape`, reusing the
+    memory of the previous call for the same data type (avoiding allocation
+    and page-fault costs when saving image series band by band, for example).
+
+    The returned array is only valid until the next call: it must not be
+    handed over to the caller."""
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    if size * dtype.itemsize > _SCRATCH_MAX_NBYTES:
+        return np.empty(shape, dtype)
+    buf = _SCRATCH.get(dtype.str)
+    if buf is None or buf.size < size:
+        buf = _SCRATCH[dtype.str] = np.empty(size, dtype)
+    return buf[:size].reshape(shape)
+
+
+def _get_quant(data):
+    """Return the :py:mod:`guiqwt._quant` module if its Numba kernels may be
+    used for array `data` (None otherwise): `data` has to be large enough to
+    amortize the JIT warm-up cost, and of native float32/float64 type (the
+    only float types the kernels support).
+
+    Numba is only imported the first time such an array is processed."""
+    if data.size > _JIT_MIN_SIZE and data.dtype.isnative and data.dtype.char in "fd":
+        return _import_optional("guiqwt._quant")
+
+
+def _minmax(data):
+    """Return (min, max) of array `data`, ignoring NaN values.
+
+    With Numba, large arrays are reduced in a single parallel pass instead of
+    two (min and max): this step is memory-bound, hence about twice faster."""
+    quant = _get_quant(data)
+    if quant is not None:
+        if data.ndim == 2:
+            return quant.minmax(data)
+        if data.ndim > 2 and data.flags.c_contiguous:
+            return quant.minmax(data.reshape(-1, data.shape[-1]))
+    return np.nanmin(data), np.nanmax(data)
+
+
+def _float_to_uint(data, dtype=np.uint8, lo=None, hi=None):
+    """Scale float array `data` to the full dynamic range of unsigned integer
+    type `dtype` and return the (rounded) result as a new array.
+
+    `lo` and `hi` are the input values mapped to 0 and to the maximum of
+    `dtype` (default: data minimum and maximum).
+
+    Unlike :py:func:`guiqwt.io.scale_data_to_dtype`, the conversion is done
+    with a single temporary of the input precision (float32 or float64) and
+    in-place ufuncs, instead of several full-size float64 copies.
+    C-contiguous 2D float32 images are processed in a single pass by the
+    `guiqwt._cvt` C extension, and other large 2D images by
+    :py:mod:`guiqwt._quant` kernels when Numba is installed.
+
+    All implementations give the same result: values out of the [`lo`, `hi`]
+    range are clipped, NaN values are set to 0 and halves are rounded to
+    even."""
+    dtype = np.dtype(dtype)
+    quant = _get_quant(data) if data.ndim == 2 else None
+    if lo is None or hi is None:
+        dmin, dmax = _minmax(data)
+        lo = dmin if lo is None else lo
+        hi = dmax if hi is None else hi
+    lo, hi = float(lo), float(hi)
+    vmax = np.iinfo(dtype).max
+    scale = vmax / (hi - lo) if hi > lo else 0.0
+    if (
+        f32_to_uint is not None
+        and data.dtype == np.float32
+        and dtype.itemsize <= 2
+        and data.ndim == 2
+        and data.flags.c_contiguous
+    ):
+        out = np.empty(data.shape, dtype)
+        f32_to_uint(data, out, lo, scale, float(vmax))
+        return out
+    if quant is not None:
+        out = np.empty(data.shape, dtype)
+        # Scalars of the input type: float32 images are quantized in float32,
+        # like with the other implementations
+        ftype = data.dtype.type
+        quant.float_to_uint(data, out, ftype(lo), ftype(scale), ftype(vmax))
+        return out
+    # Computing in the input precision, as the compiled kernels do, so that
+    # all implementations give the same result
+    ftype = np.float32 if data.dtype.itemsize <= 4 else np.float64
+    tmp = _scratch_buffer(ftype, data.shape)
+    lo, scale = ftype(lo), ftype(scale)
+    numexpr = _import_optional("numexpr")
+    if numexpr is not None:
+        numexpr.evaluate(
+            "(data - lo) * scale",
+            local_dict={"data": data, "lo": lo, "scale": scale},
+            out=tmp,
+            casting="same_kind",
+        )
+    else:
+        np.subtract(data, lo, out=tmp, casting="same_kind")
+        np.multiply(tmp, scale, out=tmp)
+    np.rint(tmp, out=tmp)
+    # Same saturation as the compiled kernels: NaN -> 0, clipped to [0, vmax]
+    np.nan_to_num(tmp, copy=False, nan=0.0)
+    np.clip(tmp, 0, vmax, out=tmp)
+    out = np.empty(data.shape, dtype)
+    np.copyto(out, tmp, casting="unsafe")
+    return out
+
+
+def _imwrite_tiff_tiled(filename, data, dtype):
+    """Quantize 2D float array `data` to `dtype` and write it to TIFF file
+    `filename`, one band of `_TILE_SIZE` rows at a time: peak memory usage is
+    then bounded by the band size instead of the whole image size"""
+    dtype = np.dtype(dtype)
+    lo, hi = _minmax(data)
+    nrows, ncols = data.shape
+
+    def tiles():
+        for y in range(0, nrows, _TILE_SIZE):
+            band = _float_to_uint(data[y : y + _TILE_SIZE], dtype, lo, hi)
+            for x in range(0, ncols, _TILE_SIZE):
+                yield band[:, x : x + _TILE_SIZE]
+
+    tifffile = _import_optional("tifffile")
+    bigtiff = data.size * dtype.itemsize >= 2 ** 31
+    with tifffile.TiffWriter(filename, bigtiff=bigtiff) as writer:
+        writer.write(
+            tiles(), shape=data.shape, dtype=dtype, tile=(_TILE_SIZE, _TILE_SIZE)
+        )
+
+
+# ===============================================================================
+# Raw image open parameters
+# ===============================================================================
+_OFFSET_LIST = ("from_end", "from_end_4k", "auto")
+_DTYPE_LIST = ("int16", "int32", "uint16", "uint32")
+#: Raw image data types, by (data type name, little endian byte order)
+_ENDIAN_DTYPES = {
+    (name, little): np.dtype(name).newbyteorder("<" if little else ">")
+    for name in _DTYPE_LIST
+    for little in (True, False)
+}
+_raw_param_classes = None
+
+
+def _get_raw_param_classes():
+    """Return raw image open parameters DataSet classes (single file, multiple
+    files), defined on first call: `guidata.dataset` is only imported when a
+    raw image is actually opened"""
+    global _raw_param_classes
+    if _raw_param_classes is None:
+        from guidata.dataset.datatypes import DataSet, ValueProp, NotProp
+        from guidata.dataset.dataitems import IntItem, ChoiceItem, BoolItem
+
+        manual_prop = ValueProp(False)
+
+        class OpenParam(DataSet):
+            """Raw image open parameters"""
+
+            dtype = ChoiceItem(
+                _("Data Type"),
+                list(zip(_DTYPE_LIST, _DTYPE_LIST)),
+                default=_DTYPE_LIST[2],
+            )
+            mode = ChoiceItem(
+                _("Offset mode"),
+                list(zip(_OFFSET_LIST, _OFFSET_LIST)),
+                default=_OFFSET_LIST[0],
+                help=_(
+                    "* auto : try to read the offset in the header.\n"
+                    "That should be the normal way of getting to offset, "
+                    "but it doesn't really work.\n"
+                    "* from_end: get offset as data_size - image_size\n"
+                    "* from_end_4k: same as from_end but additionnaly\n"
+                    "substract 4092 (seems to be streak dependant..)"
+                ),
+            ).set_prop("display", active=NotProp(manual_prop))
+            endian_switch = BoolItem(_("Little Endian Byte Order?"), default=True)
+            manual_switch = BoolItem(_("Manual Offset"), default=True).set_prop(
+                "display", store=manual_prop
+            )
+            m_offset = IntItem(
+                _("Manual Offset"),
+                default=0,
+                help=_(
+                    "Value used for points outside the "
+                    "boundaries of the input if mode is "
+                    "'constant'"
+                ),
+            ).set_prop("display", active=manual_prop)
+
+        class nOpenParam(OpenParam):
+            """Raw image*s* open parameters"""
+
+            dtype = ChoiceItem(
+                _("Data Type"),
+                list(zip(_DTYPE_LIST, _DTYPE_LIST)),
+                default=_DTYPE_LIST[0],
+            )
+            one4all = BoolItem(_("One Parameter for all?"), default=True)
+
+        _raw_param_classes = OpenParam, nOpenParam
+    return _raw_param_classes
+
+
+def _get_raw_params(param):
+    """Return :py:func:`guiqwt.io.imread` raw image parameters from
+    dataset `param` (see :py:func:`_get_raw_param_classes`)"""
+    if param.manual_switch:
+        offset = param.m_offset
+    else:
+        offset = param.mode
+    dtype = _ENDIAN_DTYPES[(param.dtype, bool(param.endian_switch))]
+    return {"offset": offset, "dtype": dtype}
+
+
+def _is_raw_filetype(ext):
+    """Return True if files with extension `ext` are read by the raw image
+    reader (which may open dialog boxes, hence has to run in the main thread)"""
+    try:
+        ftype = io.iohandler._get_filetype(ext)
+    except RuntimeError:
+        # Unsupported file type: io.imread will fail without reading anything
+        return False
+    return ftype.read_func is io._imread_raw
+
+
+@lru_cache(maxsize=32)
+def _cached_filters(action, dtype_str, has_template, nb_filetypes):
+    """Cached implementation of :py:func:`_get_filters`: the number of
+    registered file types is part of the key, so that file types added
+    after a first call are taken into account"""
+    dtype = None if dtype_str is None else np.dtype(dtype_str)
+    # File type filters only check whether a template was passed or not
+    template = True if has_template else None
+    return io.iohandler.get_filters(action, dtype=dtype, template=template)
+
+
+def _get_filters(action, dtype=None, template=None):
+    """Return file dialog filters (see
+    :py:meth:`guiqwt.io.ImageIOHandler.get_filters`), computed only once for
+    each combination of `action`, `dtype` and template presence"""
+    dtype_str = None if dtype is None else np.dtype(dtype).str
+    return _cached_filters(
+        action, dtype_str, template is not None, len(io.iohandler.filetypes)
+    )
+
 
 # ===============================================================================
 # Ready-to-use open/save dialogs
@@ -55,41 +363,37 @@ def exec_image_save_dialog(parent, data, template=None, basedir="", app_name=Non
 
     Returns filename if dialog is accepted, None otherwise
     """
-    saved_in, saved_out, saved_err = sys.stdin, sys.stdout, sys.stderr
-    sys.stdout = None
-    if data.dtype.str == '<f8' or data.dtype.str == '<f4' :
-        convert = True
-        dt = np.dtype('uint8')
-    else :
-        convert = False
-        dt = data.dtype
-    try :
-        filename, _filter = getsavefilename(parent, _("Save as"), basedir,
-            io.iohandler.get_filters('save', dtype=data.dtype, template=template))
-        sys.stdin, sys.stdout, sys.stderr = saved_in, saved_out, saved_err
-    except TypeError:
-        filename, _filter = getsavefilename(parent, _("Save as"), "",
-            io.iohandler.get_filters('save', dtype=data.dtype, template=template))
-        sys.stdin, sys.stdout, sys.stderr = saved_in, saved_out, saved_err
+    convert = data.dtype.kind == "f"
+    with redirect_stdout(StringIO()):
+        filename, _filter = getsavefilename(
+            parent,
+            _("Save as"),
+            str(basedir) if basedir else "",
+            _get_filters("save", dtype=data.dtype, template=template),
+            options=_DIALOG_OPTIONS,
+        )
     if filename:
         filename = str(filename)
+        ext = osp.splitext(filename)[1].lower()
         kwargs = {}
-        if osp.splitext(filename)[1].lower() == ".dcm":
+        if ext == ".dcm":
             kwargs["template"] = template
         try:
-            if convert == False or ext==".txt" or ext ==".csv" or ext==".asc" \
-            or ext==".dat" or ext==".npy":
+            if not convert or ext in _TEXT_EXTS:
                 io.imwrite(filename, data, **kwargs)
-            else :
-                if ext ==".tif" or ext==".tiff" or ext==".dcm":
-                    dt = np.dtype('uint16')
-                else :
-                    dt = np.dtype('uint8')
-                io.imwrite(filename, data, max_range = True, dtype = dt, **kwargs)
+            else:
+                dt = _EXT_SAVE_DTYPE.get(ext, np.dtype(np.uint8))
+                if (
+                    ext in (".tif", ".tiff")
+                    and data.ndim == 2
+                    and data.nbytes > _STREAM_THRESHOLD
+                    and _import_optional("tifffile") is not None
+                ):
+                    _imwrite_tiff_tiled(filename, data, dt)
+                else:
+                    io.imwrite(filename, _float_to_uint(data, dt), **kwargs)
             return filename
         except Exception as msg:
-            import traceback
-
             traceback.print_exc()
             QMessageBox.critical(
                 parent,
@@ -114,18 +418,18 @@ def exec_image_open_dialog(
 
     Returns (filename, data) tuple if dialog is accepted, None otherwise
     """
-    saved_in, saved_out, saved_err = sys.stdin, sys.stdout, sys.stderr
-    sys.stdout = None
-    filename, _filter = getopenfilename(
-        parent, _("Open"), basedir, io.iohandler.get_filters("load", dtype=dtype)
-    )
-    sys.stdin, sys.stdout, sys.stderr = saved_in, saved_out, saved_err
+    with redirect_stdout(StringIO()):
+        filename, _filter = getopenfilename(
+            parent,
+            _("Open"),
+            basedir,
+            _get_filters("load", dtype=dtype),
+            options=_DIALOG_OPTIONS,
+        )
     filename = str(filename)
     try:
         data = io.imread(filename, to_grayscale=to_grayscale)
     except Exception as msg:
-        import traceback
-
         traceback.print_exc()
         QMessageBox.critical(
             parent,
@@ -149,118 +453,81 @@ def exec_images_open_dialog(
 
     Yields (filename, data) tuples if dialog is accepted, None otherwise
     """
-    saved_in, saved_out, saved_err = sys.stdin, sys.stdout, sys.stderr
-    sys.stdout = None
-    filenames, _filter = getopenfilenames(
-        parent, _("Open"), basedir, io.iohandler.get_filters("load", dtype=dtype)
-    )
-    sys.stdin, sys.stdout, sys.stderr = saved_in, saved_out, saved_err
-    filenames = [str(fname) for fname in list(filenames)]
-    if filenames != []:
-        _base, ext = osp.splitext(filenames[0])
-        if ext==".bin" or ext==".raw" or ext==".img" or ext==".imd":
-            if osp.isfile(_base+".inf"):
-                RAW = False
-            else :
-                RAW = True
-        else :
+    with redirect_stdout(StringIO()):
+        filenames, _filter = getopenfilenames(
+            parent,
+            _("Open"),
+            basedir,
+            _get_filters("load", dtype=dtype),
+            options=_DIALOG_OPTIONS,
+        )
+    filenames = list(map(str, filenames))
+    # Lower case extensions: file types are matched case-insensitively
+    exts = [osp.splitext(fname)[1].lower() for fname in filenames]
+    params_list = [{}] * len(filenames)
+    if filenames:
+        if exts[0] in _RAW_EXTS:
+            RAW = not osp.isfile(osp.splitext(filenames[0])[0] + ".inf")
+        else:
             RAW = False
-        params = {}
-        if RAW==True:
-            from guidata.dataset.datatypes import DataSet, ValueProp, NotProp
-            from guidata.dataset.dataitems import (IntItem, ChoiceItem, BoolItem)
-            offset_list = ('from_end', 'from_end_4k', 'auto')
-            dtype_list = ('int16','int32','uint16','uint32')
-            prop = ValueProp(False)
-            class OpenParam(DataSet):
-                dtype = ChoiceItem(_("Data Type"), list(zip(dtype_list, dtype_list)),
-                                  default=dtype_list[2],\
-                                  )
-                mode = ChoiceItem(_("Offset mode"), list(zip(offset_list, offset_list)),
-                                  default=offset_list[0],\
-                                  help=_("* "'auto'" : try to read the offset in the header.\n \
-                                  That should be the normal way of getting to offset, but it doesn't really work.\n \
-                                  * "'from_end'": get offset as data_size - image_size\n\
-                                  * "'from_end_4k'": same as "'from_end'" but additionnaly\n\
-                                  substract 4092 (seems to be streak dependant..)")).set_prop("display", active=NotProp(prop))
-                endian_switch = BoolItem(_("Little Endian Byte Order?"),
-                                     default=True)
-                manual_switch = BoolItem(_("Manual Offset"),
-                                     default=True).set_prop("display", store=prop)
-                m_offset = IntItem(_("Manual Offset"), default=0.,
-                                 help=_("Value used for points outside the "
-                                        "boundaries of the input if mode is "
-                                        "'constant'")).set_prop("display", active=prop)
-            class nOpenParam(DataSet):
-                dtype = ChoiceItem(_("Data Type"), list(zip(dtype_list, dtype_list)),
-                                  default=dtype_list[0],\
-                                  )
-                mode = ChoiceItem(_("Offset mode"), list(zip(offset_list, offset_list)),
-                                  default=offset_list[0],\
-                                  help=_("* "'auto'" : try to read the offset in the header.\n \
-                                  That should be the normal way of getting to offset, but it doesn't really work.\n \
-                                  * "'from_end'": get offset as data_size - image_size\n\
-                                  * "'from_end_4k'": same as "'from_end'" but additionnaly\n\
-                                  substract 4092 (seems to be streak dependant..)")).set_prop("display", active=NotProp(prop))
-                endian_switch = BoolItem(_("Little Endian Byte Order?"),
-                                     default=True)
-                manual_switch = BoolItem(_("Manual Offset"),
-                                     default=True).set_prop("display", store=prop)
-                m_offset = IntItem(_("Manual Offset"), default=0.,
-                                 help=_("Value used for points outside the "
-                                        "boundaries of the input if mode is "
-                                        "'constant'")).set_prop("display", active=prop)
-                one4all = BoolItem(_("One Parameter for all?"),
-                                     default=True)
-                                     
+        if RAW:
+            # Collecting raw image parameters for all files before reading
+            # any of them, so that the loop below only does I/O
+            params_list = []
+            multiple = len(filenames) > 1
+            OpenParam, nOpenParam = _get_raw_param_classes()
             one4all = False
-            if len(filenames)>1:
-                param = nOpenParam(_("Open Raw Images"))
-                if not param.edit() :
+            for filename in filenames:
+                if one4all:
+                    params_list.append(params_list[-1])
+                    continue
+                if multiple:
+                    param = nOpenParam(
+                        _("Open Raw Images"), comment=osp.basename(filename)
+                    )
+                else:
+                    param = OpenParam(_("Open Raw Image"))
+                if not param.edit():
                     return
-                if param.manual_switch==True:
-                    offset = param.m_offset
+                one4all = multiple and param.one4all
+                params_list.append(_get_raw_params(param))
+    # Reading file N+1 in a background thread while file N is being processed
+    # by the caller (the raw image reader may open a dialog box, so it has to
+    # run in the main thread)
+    prefetch = len(filenames) > 1 and not any(map(_is_raw_filetype, set(exts)))
+    pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    future = None
+    try:
+        for index, (filename, ext) in enumerate(zip(filenames, exts)):
+            try:
+                if future is None:
+                    data = io.imread(
+                        filename,
+                        ext=ext,
+                        to_grayscale=to_grayscale,
+                        params=params_list[index],
+                    )
                 else:
-                    offset = param.mode
-                dtype = np.dtype(param.dtype)
-                if param.endian_switch==False:
-                    dtype = dtype.newbyteorder()
-                params = {'offset': offset, 'dtype': dtype}
-                one4all = param.one4all
-    for filename in filenames:
-        try:
-            _base,ext = osp.splitext(filename)
-            filename = str(filename)
-            if RAW==True :
-                if params == {} or not one4all :
-                    if len(filenames)>1:
-                        param = nOpenParam(_("Open Raw Images"))
-                        if not param.edit() :
-                            return
-                        one4all = param.one4all
-                    else :
-                        param = OpenParam(_("Open Raw Image"))
-                        if not param.edit() :
-                            return
-                    if param.manual_switch==True:
-                        offset = param.m_offset
-                    else:
-                        offset = param.mode
-                    dtype = np.dtype(param.dtype)
-                    if param.endian_switch==False:
-                        dtype = dtype.newbyteorder()
-                    params = {'offset': offset, 'dtype': dtype}
-            data = io.imread(filename, to_grayscale=to_grayscale, params=params)
-        except Exception as msg:
-            import traceback
-
-            traceback.print_exc()
-            QMessageBox.critical(
-                parent,
-                _("Error") if app_name is None else app_name,
-                (_("%s could not be opened:") % osp.basename(filename))
-                + "\n"
-                + str(msg),
-            )
-            return
-        yield filename, data
+                    data = future.result()
+                if pool is not None and index + 1 < len(filenames):
+                    future = pool.submit(
+                        io.imread,
+                        filenames[index + 1],
+                        ext=exts[index + 1],
+                        to_grayscale=to_grayscale,
+                        params=params_list[index + 1],
+                    )
+            except Exception as msg:
+                traceback.print_exc()
+                QMessageBox.critical(
+                    parent,
+                    _("Error") if app_name is None else app_name,
+                    (_("%s could not be opened:") % osp.basename(filename))
+                    + "\n"
+                    + str(msg),
+                )
+                return
+            yield filename, data
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False)
@@ -228,6 +228,16 @@ for arg, compile_arg in (
         sys.argv.pop(sys.argv.index(arg))
         CFLAGS.insert(0, compile_arg)
 
+# OpenMP support (parallel loops in Cython modules) is optional: it may not be
+# available with the default compiler (e.g. clang on macOS)
+OPENMP_CFLAGS, OPENMP_LFLAGS = [], []
+if "--openmp" in sys.argv:
+    sys.argv.pop(sys.argv.index("--openmp"))
+    if is_msvc():
+        OPENMP_CFLAGS = ["/openmp"]
+    else:
+        OPENMP_CFLAGS = OPENMP_LFLAGS = ["-fopenmp"]
+
 # Compiling Cython modules to C source code: this is the only way I found to
 # be able to build both Fortran and Cython extensions together
 # (this could be changed now as there is no longer Fortran extensions here...)
@@ -255,6 +265,7 @@ setup(
     extras_require={
         "Doc": ["Sphinx>=1.1"],
         "DICOM": ["pydicom>=0.9.3"],
+        "Numba": ["numba"],
     },
     entry_points={
         "gui_scripts": [
@@ -273,6 +284,13 @@ setup(
             [osp.join("src", "mandelbrot.c")],
             include_dirs=[numpy.get_include()],
         ),
+        Extension(
+            LIBNAME + "._cvt",
+            [osp.join("src", "_cvt.c")],
+            extra_compile_args=OPENMP_CFLAGS,
+            extra_link_args=OPENMP_LFLAGS,
+            include_dirs=[numpy.get_include()],
+        ),
         Extension(
             LIBNAME + "._scaler",
             [osp.join("src", "scaler.cpp"), osp.join("src", "pcolor.cpp")],
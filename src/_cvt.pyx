@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the terms of the CECILL License
+# (see guiqwt/__init__.py for details)
+
+"""Float to unsigned integer image conversion"""
+
+cimport cython
+from cython.parallel cimport prange
+from libc.math cimport nearbyintf
+from libc.stdint cimport uint8_t, uint16_t
+
+ctypedef fused uint_t:
+    uint8_t
+    uint16_t
+
+@cython.profile(False)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def f32_to_uint(const float[:, ::1] src, uint_t[:, ::1] dst,
+                float lo, float scale, float vmax):
+    """Quantize float32 image `src` into unsigned integer image `dst`:
+    dst = rint((src - lo) * scale), clipped to [0, vmax] (NaN -> 0)
+
+    Halves are rounded to even, as with NumPy's `rint` (see the NumPy and
+    Numba implementations in :py:mod:`guiqwt.qthelpers`)
+
+    Rows are processed in parallel when built with OpenMP support; the inner
+    loop is a straight contiguous loop, left to the C compiler vectorizer"""
+    cdef Py_ssize_t i, j
+    cdef Py_ssize_t ny = src.shape[0]
+    cdef Py_ssize_t nx = src.shape[1]
+    cdef float v
+    if dst.shape[0] != ny or dst.shape[1] != nx:
+        raise ValueError("Source and destination shapes do not match")
+    with nogil:
+        for i in prange(ny, schedule="static"):
+            for j in range(nx):
+                v = nearbyintf((src[i, j] - lo) * scale)
+                if v >= vmax:
+                    dst[i, j] = <uint_t> vmax
+                elif v > 0:
+                    dst[i, j] = <uint_t> v
+                else:
+                    dst[i, j] = 0